@@ -1,13 +1,22 @@
 from django.contrib import admin
+from django.contrib.postgres.search import SearchQuery
 from .models import Document
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
     list_display = ['title', 'user', 'status', 'page_count', 'created_at']
     list_filter = ['status', 'created_at']
-    search_fields = ['title', 'text_content']
+    search_fields = ['title']  # Enables the search box, see get_search_results
     readonly_fields = ['created_at', 'updated_at', 'text_content', 'search_vector', 'meta_data', 'page_count']
     
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.select_related('user')
+        # text_content is only needed on the change form, where it is loaded on access
+        return qs.select_related('user').defer('text_content')
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Full text search on the GIN-indexed search_vector (covers title and text_content)
+        # instead of the default ILIKE over search_fields
+        if search_term:
+            queryset = queryset.filter(search_vector=SearchQuery(search_term, config='english'))
+        return queryset, False
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class DocumentsConfig(AppConfig):
     name = 'apps.documents'
+
+    def ready(self):
+        import google.generativeai as genai
+        from django.conf import settings
+
+        # Configure Gemini once per process, not per request
+        if settings.GEMINI_API_KEY:
+            genai.configure(api_key=settings.GEMINI_API_KEY)
@@ -0,0 +1,47 @@
+"""
+Management command to compile .env into a plain Python module (config/_env_compiled.py).
+settings.py imports the compiled module instead of parsing .env on every startup.
+Re-run it after editing .env.
+"""
+from pathlib import Path
+from dotenv import dotenv_values
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Compile .env into config/_env_compiled.py so startup skips dotenv parsing'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Remove the compiled module and go back to loading .env',
+        )
+
+    def handle(self, *args, **options):
+        base_dir = Path(settings.BASE_DIR)
+        env_path = base_dir / '.env'
+        output_path = base_dir / 'config' / '_env_compiled.py'
+
+        if options['clear']:
+            output_path.unlink(missing_ok=True)
+            self.stdout.write(self.style.SUCCESS(f'Removed {output_path}'))
+            return
+
+        if not env_path.exists():
+            raise CommandError(f'{env_path} not found')
+
+        # Keys without a value (e.g. a bare "KEY" line) are skipped, like load_dotenv does
+        values = {k: v for k, v in dotenv_values(env_path).items() if v is not None}
+
+        lines = [
+            '# Generated by `manage.py compile_env` from .env, do not edit or commit.',
+            'ENV = {',
+            *(f'    {key!r}: {value!r},' for key, value in sorted(values.items())),
+            '}',
+            '',
+        ]
+        output_path.write_text('\n'.join(lines))
+
+        self.stdout.write(self.style.SUCCESS(f'Compiled {len(values)} variables into {output_path}'))
@@ -1,9 +1,33 @@
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from django.core.files.storage import default_storage
+from django.core.files.storage import FileSystemStorage, storages
 from apps.documents.models import Document
 import os
 import boto3
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# S3 delete_objects accepts at most 1000 keys per request
+S3_DELETE_BATCH_SIZE = 1000
+S3_DELETE_WORKERS = 8
+LOCAL_DELETE_WORKERS = 32
+
+
+def delete_local_file(storage, name):
+    """Delete a stored file, returning None on success or the reason it failed."""
+    try:
+        if isinstance(storage, FileSystemStorage):
+            # FileSystemStorage.delete() ignores missing files, unlink directly to see them
+            os.remove(storage.path(name))
+        elif storage.exists(name):
+            storage.delete(name)
+        else:
+            return 'File not found'
+        return None
+    except FileNotFoundError:
+        return 'File not found'
+    except Exception as e:
+        return str(e)
 
 
 class Command(BaseCommand):
@@ -28,8 +52,6 @@ class Command(BaseCommand):
             )
             return
         
-        # Get all documents before deletion
-        documents = Document.objects.all()
         files_deleted = 0
         files_failed = 0
         
@@ -37,7 +59,7 @@ class Command(BaseCommand):
         using_s3 = hasattr(settings, 'AWS_ACCESS_KEY_ID') and settings.AWS_ACCESS_KEY_ID
         
         if using_s3:
-            # Delete from S3
+            # Delete from S3 in batches - delete_objects accepts up to 1000 keys per request
             self.stdout.write('Deleting files from S3...')
             s3 = boto3.client(
                 's3',
@@ -46,37 +68,66 @@ class Command(BaseCommand):
                 region_name=settings.AWS_S3_REGION_NAME
             )
             
-            for doc in documents:
-                if doc.file.name:
-                    try:
-                        s3.delete_object(
-                            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
-                            Key=doc.file.name
-                        )
-                        files_deleted += 1
-                    except Exception as e:
-                        self.stdout.write(
-                            self.style.WARNING(f'Failed to delete S3 file {doc.file.name}: {e}')
+            # A single client is shared by all batches (boto3 clients are thread-safe)
+            def delete_batch(keys):
+                response = s3.delete_objects(
+                    Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+                    Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+                )
+                # Quiet mode only reports the keys that failed
+                return response.get('Errors', [])
+            
+            keys = Document.objects.exclude(file='').values_list('file', flat=True).iterator(
+                chunk_size=S3_DELETE_BATCH_SIZE
+            )
+            
+            # Submit batches to a thread pool so the network round trips overlap
+            futures = {}
+            with ThreadPoolExecutor(max_workers=S3_DELETE_WORKERS) as executor:
+                batch = []
+                for key in keys:
+                    batch.append(key)
+                    if len(batch) == S3_DELETE_BATCH_SIZE:
+                        futures[executor.submit(delete_batch, batch)] = batch
+                        batch = []
+                if batch:
+                    futures[executor.submit(delete_batch, batch)] = batch
+            
+            for future, batch in futures.items():
+                try:
+                    errors = future.result()
+                except Exception as e:
+                    self.stdout.write(
+                        self.style.WARNING(f'Failed to delete batch of {len(batch)} S3 files: {e}')
+                    )
+                    files_failed += len(batch)
+                    continue
+                
+                for error in errors:
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f'Failed to delete S3 file {error.get("Key")}: {error.get("Message", error.get("Code"))}'
                         )
-                        files_failed += 1
+                    )
+                files_deleted += len(batch) - len(errors)
+                files_failed += len(errors)
         else:
             # Delete from local filesystem using Django's storage API
             self.stdout.write('Deleting files from local storage...')
-            for doc in documents:
-                if doc.file and doc.file.name:
-                    try:
-                        # Use Django's storage API for consistency
-                        if default_storage.exists(doc.file.name):
-                            default_storage.delete(doc.file.name)
-                            files_deleted += 1
-                        else:
-                            self.stdout.write(
-                                self.style.WARNING(f'File not found: {doc.file.name}')
-                            )
-                            files_failed += 1
-                    except Exception as e:
+            
+            # The resolved backend, not the default_storage proxy every thread would go through
+            delete = partial(delete_local_file, storages['default'])
+            
+            keys = list(Document.objects.exclude(file='').values_list('file', flat=True))
+            
+            # Unlink calls are I/O-bound, so overlap them in a thread pool
+            with ThreadPoolExecutor(max_workers=LOCAL_DELETE_WORKERS) as executor:
+                for name, error in zip(keys, executor.map(delete, keys)):
+                    if error is None:
+                        files_deleted += 1
+                    else:
                         self.stdout.write(
-                            self.style.WARNING(f'Failed to delete file {doc.file.name}: {e}')
+                            self.style.WARNING(f'Failed to delete file {name}: {error}')
                         )
                         files_failed += 1
         
@@ -5,6 +5,14 @@ from django.core.management.base import BaseCommand
 from apps.documents.models import Document
 from apps.documents.tasks import generate_document_embeddings
 
+# Number of documents per Celery chunk message. Each chunk embeds its documents one after
+# another, so keep it small enough that a slow document doesn't hold up many others
+QUEUE_CHUNK_SIZE = 10
+# Chunks run as celery.starmap tasks, which CELERY_TASK_ROUTES doesn't route
+EMBEDDING_QUEUE = 'io'
+# Rows fetched per round trip when streaming documents
+STREAM_CHUNK_SIZE = 2000
+
 
 class Command(BaseCommand):
     help = 'Reprocess embeddings for documents with PENDING or FAILED embedding status'
@@ -32,10 +40,8 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR(f'Document {options["doc_id"]} not found'))
         elif options['all']:
             docs = Document.objects.filter(status=Document.Status.COMPLETED)
-            count = docs.count()
-            self.stdout.write(f'Reprocessing {count} documents...')
-            for doc in docs:
-                generate_document_embeddings.delay(doc.id)
+            self.stdout.write('Reprocessing all completed documents...')
+            count = self.queue_embeddings(docs.values_list('id', flat=True).iterator(chunk_size=STREAM_CHUNK_SIZE))
             self.stdout.write(self.style.SUCCESS(f'Queued {count} documents for embedding generation'))
         else:
             # Default: reprocess PENDING and FAILED
@@ -43,16 +49,28 @@ class Command(BaseCommand):
                 status=Document.Status.COMPLETED,
                 embedding_status__in=[Document.EmbeddingStatus.PENDING, Document.EmbeddingStatus.FAILED]
             )
-            count = docs.count()
-            self.stdout.write(f'Found {count} documents with PENDING or FAILED embedding status')
+            self.stdout.write('Documents with PENDING or FAILED embedding status:')
+            
+            # Stream rows through a server-side cursor instead of loading the whole queryset
+            ids = []
+            for doc in docs.only('id', 'title').iterator(chunk_size=STREAM_CHUNK_SIZE):
+                self.stdout.write(f'  - Document {doc.id}: {doc.title[:50]}')
+                ids.append(doc.id)
             
-            if count == 0:
+            if not ids:
                 self.stdout.write(self.style.WARNING('No documents to reprocess'))
                 return
             
-            for doc in docs:
-                self.stdout.write(f'  - Document {doc.id}: {doc.title[:50]}')
-                generate_document_embeddings.delay(doc.id)
-            
+            count = self.queue_embeddings(ids)
             self.stdout.write(self.style.SUCCESS(f'Queued {count} documents for embedding generation'))
 
+    def queue_embeddings(self, ids):
+        """
+        Queue embedding generation for the given document IDs.
+        Sends one broker message per QUEUE_CHUNK_SIZE documents instead of one per document.
+        Returns the number of documents queued.
+        """
+        args = [(doc_id,) for doc_id in ids]
+        if args:
+            generate_document_embeddings.chunks(args, QUEUE_CHUNK_SIZE).group().apply_async(queue=EMBEDDING_QUEUE)
+        return len(args)
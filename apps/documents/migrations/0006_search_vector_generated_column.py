@@ -0,0 +1,65 @@
+# Migration to turn search_vector into a STORED generated column
+# Postgres keeps the tsvector in sync with title/text_content on every INSERT/UPDATE,
+# so the application no longer needs to run a separate UPDATE after saving
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_remove_documentchunk_unique_document_chunk_and_more'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                # Dropping the column also drops its GIN index, so recreate it afterwards
+                migrations.RunSQL(
+                    sql="""
+                        ALTER TABLE documents_document DROP COLUMN search_vector;
+                        ALTER TABLE documents_document ADD COLUMN search_vector tsvector
+                            GENERATED ALWAYS AS (
+                                setweight(to_tsvector('english'::regconfig, coalesce(title, '')), 'A') ||
+                                setweight(to_tsvector('english'::regconfig, coalesce(text_content, '')), 'B')
+                            ) STORED;
+                        CREATE INDEX documents_d_search__05a045_gin ON documents_document USING gin (search_vector);
+                    """,
+                    reverse_sql="""
+                        ALTER TABLE documents_document DROP COLUMN search_vector;
+                        ALTER TABLE documents_document ADD COLUMN search_vector tsvector NULL;
+                        UPDATE documents_document SET search_vector =
+                            setweight(to_tsvector('english'::regconfig, coalesce(title, '')), 'A') ||
+                            setweight(to_tsvector('english'::regconfig, coalesce(text_content, '')), 'B');
+                        CREATE INDEX documents_d_search__05a045_gin ON documents_document USING gin (search_vector);
+                    """,
+                ),
+            ],
+            state_operations=[
+                migrations.RemoveIndex(
+                    model_name='document',
+                    name='documents_d_search__05a045_gin',
+                ),
+                migrations.RemoveField(
+                    model_name='document',
+                    name='search_vector',
+                ),
+                migrations.AddField(
+                    model_name='document',
+                    name='search_vector',
+                    field=models.GeneratedField(
+                        db_persist=True,
+                        expression=SearchVector('title', weight='A', config='english') + SearchVector('text_content', weight='B', config='english'),
+                        output_field=django.contrib.postgres.search.SearchVectorField(),
+                    ),
+                ),
+                migrations.AddIndex(
+                    model_name='document',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='documents_d_search__05a045_gin'),
+                ),
+            ],
+        ),
+    ]
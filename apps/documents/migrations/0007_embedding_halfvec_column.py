@@ -0,0 +1,44 @@
+# Migration to store embeddings as a native halfvec(768) column
+# Similarity search no longer has to parse JSON through jsonb_to_halfvec() for every row
+
+import pgvector.django
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_search_vector_generated_column'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql="""
+                        ALTER TABLE documents_documentchunk ADD COLUMN embedding_v halfvec(768);
+                        UPDATE documents_documentchunk
+                            SET embedding_v = jsonb_to_halfvec(embedding)
+                            WHERE embedding IS NOT NULL;
+                        ALTER TABLE documents_documentchunk DROP COLUMN embedding;
+                        ALTER TABLE documents_documentchunk RENAME COLUMN embedding_v TO embedding;
+                    """,
+                    reverse_sql="""
+                        ALTER TABLE documents_documentchunk ADD COLUMN embedding_j jsonb;
+                        UPDATE documents_documentchunk
+                            SET embedding_j = to_jsonb(embedding::real[])
+                            WHERE embedding IS NOT NULL;
+                        ALTER TABLE documents_documentchunk DROP COLUMN embedding;
+                        ALTER TABLE documents_documentchunk RENAME COLUMN embedding_j TO embedding;
+                    """,
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='documentchunk',
+                    name='embedding',
+                    field=pgvector.django.HalfVectorField(blank=True, dimensions=768, null=True),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Migration to create the HNSW index on embeddings
+# Replaces the no-op in 0003 now that embedding is a native halfvec(768) column
+# State only: 0009 replaces this index with a binary quantized one, building it first
+# would be a wasted full index build. Databases that already built it have it dropped by 0009.
+
+import pgvector.django
+from django.db import migrations
+from django.db.models import Q
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_embedding_halfvec_column'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='documentchunk',
+                    index=pgvector.django.HnswIndex(
+                        condition=Q(embedding__isnull=False),
+                        ef_construction=64,
+                        fields=['embedding'],
+                        m=16,
+                        name='documentchunk_embedding_hnsw',
+                        opclasses=['halfvec_cosine_ops'],
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Migration to switch the ANN index to binary quantized embeddings
+# binary_quantize() keeps one bit per dimension (96 bytes vs 1.5 KB per halfvec(768)),
+# the coarse Hamming search is then re-ranked by exact cosine distance in find_similar_chunks
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+import pgvector.django
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('documents', '0008_documentchunk_embedding_hnsw'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='documentchunk',
+            index=pgvector.django.HnswIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.comparison.Cast(
+                        models.Func('embedding', function='binary_quantize'),
+                        output_field=pgvector.django.BitField(length=768),
+                    ),
+                    name='bit_hamming_ops',
+                ),
+                condition=models.Q(embedding__isnull=False),
+                ef_construction=64,
+                m=16,
+                name='documentchunk_emb_bin_hnsw',
+            ),
+        ),
+        # Similarity search no longer orders by the halfvec column directly
+        # 0008 only added the index to the state, it exists only on databases migrated before that
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql='DROP INDEX CONCURRENTLY IF EXISTS documentchunk_embedding_hnsw;',
+                    reverse_sql=migrations.RunSQL.noop,
+                ),
+            ],
+            state_operations=[
+                migrations.RemoveIndex(
+                    model_name='documentchunk',
+                    name='documentchunk_embedding_hnsw',
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Migration to drop jsonb_to_halfvec, only 0007's backfill ever called it
+# (embeddings are a native halfvec(768) column since then)
+# Databases that applied an earlier SQL rewrite of this migration just keep an unused function.
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_documentchunk_binary_quantized_hnsw'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="DROP FUNCTION IF EXISTS jsonb_to_halfvec(jsonb);",
+            reverse_sql="""
+                CREATE OR REPLACE FUNCTION jsonb_to_halfvec(jsonb_data jsonb)
+                RETURNS halfvec(768) AS $$
+                DECLARE
+                    result_array float4[];
+                BEGIN
+                    SELECT array_agg(value::float4 ORDER BY ordinality)
+                    INTO result_array
+                    FROM jsonb_array_elements_text(jsonb_data) WITH ORDINALITY AS t(value, ordinality);
+                    
+                    -- Ensure the array has exactly 768 elements
+                    IF array_length(result_array, 1) != 768 THEN
+                        RAISE EXCEPTION 'Array must have exactly 768 elements, got %', array_length(result_array, 1);
+                    END IF;
+                    
+                    RETURN result_array::halfvec(768);
+                END;
+                $$ LANGUAGE plpgsql IMMUTABLE;
+            """,
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Migration to add a partial index matching reprocess_embeddings' default filter
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_jsonb_to_halfvec_sql_function'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(
+                condition=models.Q(('embedding_status__in', ['PENDING', 'FAILED']), ('status', 'COMPLETED')),
+                fields=['embedding_status'],
+                name='document_reprocess_idx',
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Migration to track pending Gemini Batch API extractions on the document
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0011_document_reprocess_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='gemini_batch_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='gemini_file_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(
+                condition=models.Q(('gemini_batch_name', ''), _negated=True),
+                fields=['gemini_batch_name'],
+                name='document_gemini_batch_idx',
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Migration to add a (user, created_at DESC) index for cursor paginated document lists
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0012_document_gemini_batch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['user', '-created_at'], name='document_user_created_idx'),
+        ),
+    ]
@@ -1,7 +1,9 @@
 from django.db import models
 from django.contrib.auth import get_user_model
-from django.contrib.postgres.search import SearchVectorField
-from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db.models.functions import Cast
+from pgvector.django import BitField, HalfVectorField, HnswIndex
 
 User = get_user_model()
 
@@ -26,7 +28,13 @@ class Document(models.Model):
     
     # Extraction results
     text_content = models.TextField(blank=True, default='')
-    search_vector = SearchVectorField(null=True, blank=True) # For full text search
+    # For full text search - STORED generated column, maintained by Postgres on INSERT and on
+    # UPDATEs that change title or text_content (status-only saves do not recompute it)
+    search_vector = models.GeneratedField(
+        expression=SearchVector('title', weight='A', config='english') + SearchVector('text_content', weight='B', config='english'),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
     
     # Metadata
     meta_data = models.JSONField(default=dict, blank=True)
@@ -45,12 +53,33 @@ class Document(models.Model):
     )
     error_message = models.TextField(blank=True, default='')
     
+    # Pending Gemini Batch API extraction, cleared once the batch finishes
+    gemini_batch_name = models.CharField(max_length=255, blank=True, default='')
+    gemini_file_name = models.CharField(max_length=255, blank=True, default='')
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         indexes = [
             GinIndex(fields=['search_vector']),
+            # Per-user newest-first listing (cursor pagination seeks on it)
+            models.Index(fields=['user', '-created_at'], name='document_user_created_idx'),
+            # Partial index for reprocess_embeddings' default PENDING/FAILED lookup
+            models.Index(
+                fields=['embedding_status'],
+                name='document_reprocess_idx',
+                condition=models.Q(
+                    status='COMPLETED',
+                    embedding_status__in=['PENDING', 'FAILED'],
+                ),
+            ),
+            # Partial index for poll_gemini_batches, only rows with a pending batch
+            models.Index(
+                fields=['gemini_batch_name'],
+                name='document_gemini_batch_idx',
+                condition=~models.Q(gemini_batch_name=''),
+            ),
         ]
         ordering = ['-created_at']
 
@@ -61,20 +90,31 @@ class Document(models.Model):
 class DocumentChunk(models.Model):
     """
     Stores text chunks from PDFs with their embeddings.
-    Embeddings are stored as JSONField and will be cast to halfvec(3072) in SQL queries.
+    Embeddings are stored in a native pgvector halfvec(768) column.
     """
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
     chunk_text = models.TextField()
     chunk_index = models.IntegerField()  # Order of chunk in document
-    # Embedding stored as JSON array (list of 3072 float values)
-    # Will be cast to halfvec(3072) in SQL queries for similarity search
-    embedding = models.JSONField(null=True, blank=True)  # List of 3072 floats
+    # Embedding stored as half precision vector (768 values) for similarity search
+    embedding = HalfVectorField(dimensions=768, null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         indexes = [
             models.Index(fields=['document', 'chunk_index']),
+            # ANN index on binary quantized embeddings (1 bit per dimension) for the coarse
+            # similarity pass, only chunks with an embedding are searchable
+            HnswIndex(
+                OpClass(
+                    Cast(models.Func('embedding', function='binary_quantize'), output_field=BitField(length=768)),
+                    name='bit_hamming_ops',
+                ),
+                name='documentchunk_emb_bin_hnsw',
+                m=16,
+                ef_construction=64,
+                condition=models.Q(embedding__isnull=False),
+            ),
         ]
         ordering = ['document', 'chunk_index']
         unique_together = [['document', 'chunk_index']]
@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Keyset pagination on created_at (newest first), no COUNT(*) or OFFSET scans.
+    """
+    ordering = '-created_at'
+    page_size = 10
@@ -35,6 +35,7 @@ class DocumentSerializer(serializers.ModelSerializer):
                 raise ValidationError(f"Only PDF files are allowed. Received: {value.content_type}")
         
         # 4. Check PDF magic bytes (most reliable check)
+        # Only the 4 header bytes are read, the upload itself stays in its temp file
         # Save current position
         current_position = value.tell()
         value.seek(0)
@@ -49,3 +50,11 @@ class DocumentSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
+
+
+class DocumentListSerializer(DocumentSerializer):
+    """
+    List responses leave out the (potentially MB sized) extracted text.
+    """
+    class Meta(DocumentSerializer.Meta):
+        fields = ['id', 'title', 'file', 'status', 'status_display', 'page_count', 'created_at']
@@ -1,25 +1,33 @@
 """
 Service functions for Gemini API interactions, text chunking, and embedding operations.
 """
+import io
 import logging
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
 import google.generativeai as genai
-import numpy as np
+import tiktoken
 from django.conf import settings
-from django.db import connection
+from django.db import connection, transaction
+from django.utils import timezone
+
+if TYPE_CHECKING:
+    from .models import Document
 
 logger = logging.getLogger(__name__)
 
-# Initialize Gemini client
-if settings.GEMINI_API_KEY:
-    genai.configure(api_key=settings.GEMINI_API_KEY)
+# Gemini is configured once in DocumentsConfig.ready()
 
 # Embedding model configuration
 EMBEDDING_MODEL = 'models/embedding-001'
 # Note: embedding-001 returns 768 dimensions by default
 # output_dimensionality parameter only REDUCES dimensions, not increases
 EMBEDDING_DIMENSIONS = 768
-CHUNK_SIZE = 1000  # Approximate tokens per chunk
+TOKENIZER_ENCODING = 'cl100k_base'  # tiktoken encoding used for chunking
+CHUNK_SIZE = 1000  # Tokens per chunk
 CHUNK_OVERLAP = 200  # Overlap tokens between chunks
+EMBEDDING_BATCH_SIZE = 100  # Texts per embed_content call
+RERANK_CANDIDATES = 200  # Binary quantized candidates re-ranked by exact cosine distance
 
 
 def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
@@ -28,7 +36,7 @@ def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
     
     Args:
         text: The text to chunk
-        chunk_size: Approximate number of tokens per chunk (using word count as proxy)
+        chunk_size: Number of tokens per chunk
         overlap: Number of tokens to overlap between chunks
     
     Returns:
@@ -37,66 +45,63 @@ def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
     if not text or not text.strip():
         return []
     
-    # Simple word-based chunking (can be improved with tokenizer)
-    words = text.split()
-    chunks = []
+    # Tokenize once with tiktoken's compiled encoder, then slice token windows
+    encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+    tokens = encoding.encode_ordinary(text)
     
-    if len(words) <= chunk_size:
+    if len(tokens) <= chunk_size:
         return [text]
     
-    i = 0
-    while i < len(words):
-        chunk_words = words[i:i + chunk_size]
-        chunk_text = ' '.join(chunk_words)
-        chunks.append(chunk_text)
-        
-        # Move forward by chunk_size - overlap to create overlap
-        i += chunk_size - overlap
-        
-        # Prevent infinite loop
-        if i >= len(words):
-            break
-    
-    return chunks
+    # Move forward by chunk_size - overlap to create overlap,
+    # stopping once a window reaches the end of the text
+    step = chunk_size - overlap
+    return [
+        encoding.decode(tokens[i:i + chunk_size])
+        for i in range(0, len(tokens) - overlap, step)
+    ]
 
 
-def generate_embedding(text):
+def generate_embeddings_batch(texts, batch_size=EMBEDDING_BATCH_SIZE):
     """
-    Generate embedding for text using Gemini Embedding API.
+    Generate embeddings for a list of texts using Gemini Embedding API.
+    Texts are sent batch_size at a time, one API round trip per batch.
     
     Args:
-        text: Text to generate embedding for
+        texts: List of texts to generate embeddings for
+        batch_size: Maximum number of texts per API call
     
     Returns:
-        List of 768 float values (embedding vector)
+        List of embeddings (each a list of 768 float values), in the same order as texts
     """
     try:
         if not settings.GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY not configured")
         
-        # Generate embedding
-        # Note: embedding-001 returns 768 dimensions by default
-        # output_dimensionality parameter only reduces dimensions, not increases
-        result = genai.embed_content(
-            model=EMBEDDING_MODEL,
-            content=text,
-            task_type="retrieval_document"
-        )
-        
-        embedding = result['embedding']
-        
-        # Ensure it's the right dimensions
-        if len(embedding) != EMBEDDING_DIMENSIONS:
-            logger.warning(f"Expected {EMBEDDING_DIMENSIONS} dimensions, got {len(embedding)}")
-            # If wrong dimensions, raise error to prevent issues
-            raise ValueError(f"Embedding has {len(embedding)} dimensions, expected {EMBEDDING_DIMENSIONS}")
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            # Generate embeddings for the whole batch in one call
+            # Note: embedding-001 returns 768 dimensions by default
+            # output_dimensionality parameter only reduces dimensions, not increases
+            result = genai.embed_content(
+                model=EMBEDDING_MODEL,
+                content=texts[start:start + batch_size],
+                task_type="retrieval_document"
+            )
+            
+            for embedding in result['embedding']:
+                # Ensure it's the right dimensions
+                if len(embedding) != EMBEDDING_DIMENSIONS:
+                    logger.warning(f"Expected {EMBEDDING_DIMENSIONS} dimensions, got {len(embedding)}")
+                    # If wrong dimensions, raise error to prevent issues
+                    raise ValueError(f"Embedding has {len(embedding)} dimensions, expected {EMBEDDING_DIMENSIONS}")
+                
+                # Stored as-is, the halfvec(768) column converts to half precision in Postgres
+                embeddings.append(embedding)
         
-        # Convert to half precision (float16) for storage
-        embedding_array = np.array(embedding, dtype=np.float16)
-        return embedding_array.tolist()
+        return embeddings
     
     except Exception as e:
-        logger.error(f"Error generating embedding: {str(e)}")
+        logger.error(f"Error generating embeddings: {str(e)}")
         raise
 
 
@@ -129,15 +134,74 @@ def generate_query_embedding(query_text):
             logger.warning(f"Expected {EMBEDDING_DIMENSIONS} dimensions, got {len(embedding)}")
             raise ValueError(f"Query embedding has {len(embedding)} dimensions, expected {EMBEDDING_DIMENSIONS}")
         
-        # Convert to half precision
-        embedding_array = np.array(embedding, dtype=np.float16)
-        return embedding_array.tolist()
+        # Bound as a halfvec(768) literal, Postgres converts to half precision
+        return embedding
     
     except Exception as e:
         logger.error(f"Error generating query embedding: {str(e)}")
         raise
 
 
+def _copy_escape(value):
+    """
+    Escape a string for PostgreSQL COPY text format.
+    """
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_chunks(chunk_objects):
+    """
+    Insert unsaved DocumentChunk objects with a single COPY ... FROM STDIN statement.
+    Streams all rows in one statement instead of a parameterized INSERT per batch.
+    
+    Args:
+        chunk_objects: List of unsaved DocumentChunk instances
+    
+    Returns:
+        Number of rows written
+    """
+    if connection.vendor != 'postgresql':
+        # COPY is Postgres only, fall back to batched INSERTs
+        from .models import DocumentChunk
+        DocumentChunk.objects.bulk_create(chunk_objects, batch_size=500)
+        return len(chunk_objects)
+    
+    created_at = timezone.now().isoformat()
+    buffer = io.StringIO()
+    for chunk in chunk_objects:
+        if chunk.embedding is None:
+            embedding_str = '\\N'  # NULL
+        else:
+            # pgvector text format, parsed by the halfvec(768) column
+            embedding_str = '[' + ','.join(map(str, chunk.embedding)) + ']'
+        buffer.write(
+            f"{chunk.document_id}\t{chunk.chunk_index}\t{_copy_escape(chunk.chunk_text)}\t{embedding_str}\t{created_at}\n"
+        )
+    buffer.seek(0)
+    
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            "COPY documents_documentchunk (document_id, chunk_index, chunk_text, embedding, created_at) FROM STDIN",
+            buffer
+        )
+    return len(chunk_objects)
+
+
+@dataclass
+class SimilarChunk:
+    """
+    Lightweight search result for a chunk, built straight from the similarity query row.
+    `document` is a partially loaded Document (id, title, file, page_count, created_at).
+    """
+    chunk_id: int
+    chunk_text: str
+    chunk_index: int
+    document_id: int
+    document_title: str
+    similarity_score: float
+    document: 'Document'
+
+
 def find_similar_chunks(query_embedding, user, limit=10):
     """
     Find similar chunks using pgvector similarity search on halfvec.
@@ -148,55 +212,101 @@ def find_similar_chunks(query_embedding, user, limit=10):
         limit: Maximum number of results to return
     
     Returns:
-        List of DocumentChunk objects with similarity scores
+        List of SimilarChunk objects with similarity scores
     """
-    from .models import DocumentChunk
+    from .models import Document
     
     try:
-        with connection.cursor() as cursor:
+        # Coarse pass fetches more candidates than the final limit
+        candidates = max(limit, RERANK_CANDIDATES)
+        
+        # SET LOCAL only applies inside a transaction
+        with transaction.atomic(), connection.cursor() as cursor:
+            # HNSW returns at most ef_search rows, so the candidate list size is the candidate count
+            cursor.execute("SET LOCAL hnsw.ef_search = %s", [candidates])
+            # The user filter is applied after the index scan, so let pgvector (0.8+) keep
+            # scanning the graph until enough of this user's chunks are found.
+            # Candidates are re-ranked below, so relaxed ordering is fine here.
+            cursor.execute("SET LOCAL hnsw.iterative_scan = relaxed_order")
+            
             # Convert embedding list to string format for PostgreSQL
             embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
+            # Same as pgvector's binary_quantize(): one bit per dimension, set when positive
+            embedding_bits = ''.join('1' if value > 0 else '0' for value in query_embedding)
             
-            # SQL query using pgvector's <-> operator for cosine distance on halfvec(768)
-            # Use the jsonb_to_halfvec function to convert JSON to halfvec(768)
+            # Two-stage search:
+            # 1. Hamming distance (<~>) on binary quantized embeddings, served by the bit HNSW index
+            # 2. Re-rank those candidates by exact cosine distance (<=>) on halfvec(768)
+            # Document columns are selected here so no follow-up ORM query is needed
+            # `dc.embedding IS NOT NULL` must stay in the WHERE clause: it matches the
+            # partial index predicate, without it the planner cannot use the HNSW index
             query = """
+                WITH candidates AS (
+                    SELECT 
+                        dc.id,
+                        dc.chunk_text,
+                        dc.chunk_index,
+                        dc.embedding,
+                        d.id AS document_id,
+                        d.title,
+                        d.file,
+                        d.page_count,
+                        d.created_at
+                    FROM documents_documentchunk dc
+                    INNER JOIN documents_document d ON dc.document_id = d.id
+                    WHERE d.user_id = %s
+                      AND dc.embedding IS NOT NULL
+                    ORDER BY binary_quantize(dc.embedding)::bit(768) <~> %s::bit(768)
+                    LIMIT %s
+                )
                 SELECT 
-                    dc.id,
-                    dc.document_id,
-                    dc.chunk_text,
-                    dc.chunk_index,
-                    jsonb_to_halfvec(dc.embedding) <-> %s::halfvec(768) AS distance
-                FROM documents_documentchunk dc
-                INNER JOIN documents_document d ON dc.document_id = d.id
-                WHERE d.user_id = %s
-                  AND dc.embedding IS NOT NULL
-                ORDER BY jsonb_to_halfvec(dc.embedding) <-> %s::halfvec(768)
+                    id,
+                    chunk_text,
+                    chunk_index,
+                    document_id,
+                    title,
+                    file,
+                    page_count,
+                    created_at,
+                    embedding <=> %s::halfvec(768) AS distance
+                FROM candidates
+                ORDER BY distance
                 LIMIT %s
             """
             
-            cursor.execute(query, [embedding_str, user.id, embedding_str, limit])
+            cursor.execute(query, [user.id, embedding_bits, candidates, embedding_str, limit])
             results = cursor.fetchall()
-            
-            # Get chunk objects
-            chunk_ids = [row[0] for row in results]
-            chunks = DocumentChunk.objects.filter(id__in=chunk_ids).select_related('document')
-            
-            # Create a dict for quick lookup
-            chunk_dict = {chunk.id: chunk for chunk in chunks}
-            
-            # Return chunks with distance scores
-            similar_chunks = []
-            for row in results:
-                chunk_id, doc_id, chunk_text, chunk_index, distance = row
-                chunk = chunk_dict.get(chunk_id)
-                if chunk:
-                    chunk.similarity_score = 1.0 - distance  # Convert distance to similarity
-                    similar_chunks.append(chunk)
-            
-            return similar_chunks
+        
+        # Build one Document instance per document, shared by its chunks
+        documents = {}
+        similar_chunks = []
+        for row in results:
+            chunk_id, chunk_text, chunk_index, doc_id, title, file, page_count, created_at, distance = row
+            doc = documents.get(doc_id)
+            if doc is None:
+                doc = Document.from_db(
+                    connection.alias,
+                    ['id', 'title', 'file', 'page_count', 'created_at'],
+                    [doc_id, title, file, page_count, created_at],
+                )
+                documents[doc_id] = doc
+            similar_chunks.append(SimilarChunk(
+                chunk_id=chunk_id,
+                chunk_text=chunk_text,
+                chunk_index=chunk_index,
+                document_id=doc_id,
+                document_title=title,
+                similarity_score=1.0 - distance,  # Convert distance to similarity
+                document=doc,
+            ))
+        
+        return similar_chunks
     
-    except Exception as e:
-        logger.error(f"Error finding similar chunks: {str(e)}")
-        # Fallback: return empty list
+    except Exception:
+        # Not an empty result: say so loudly, an outdated pgvector fails on every query
+        logger.exception(
+            "Semantic search failed, returning no results. It needs pgvector 0.8+ "
+            "(hnsw.iterative_scan, binary_quantize) - check SELECT extversion FROM pg_extension "
+            "WHERE extname = 'vector'"
+        )
         return []
-
@@ -1,202 +1,618 @@
-import io
+import billiard
 import boto3
+import botocore.config
+from boto3.s3.transfer import TransferConfig
 import pypdf
 import pytesseract
-from pdf2image import convert_from_bytes
+from pdf2image import convert_from_path
 from celery import shared_task
+from celery.signals import worker_process_init
 from django.conf import settings
-from django.contrib.postgres.search import SearchVector
+from django.core.cache import cache
+from django.db import transaction
 from .models import Document, DocumentChunk
-from .services import chunk_text, generate_embedding
+from .services import chunk_text, copy_chunks, generate_embeddings_batch
+import hashlib
+import mmap
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 import tempfile
 import logging
 import google.generativeai as genai
+from google.genai import Client as GeminiClient
 
 logger = logging.getLogger(__name__)
 
-# Configure Gemini
-if settings.GEMINI_API_KEY:
-    genai.configure(api_key=settings.GEMINI_API_KEY)
+# Gemini is configured once in DocumentsConfig.ready()
+
+# Extracted text is cached by file content, so re-uploads of the same PDF skip extraction
+EXTRACTION_CACHE_PREFIX = 'pdfextract'
+OCR_PAGE_CACHE_PREFIX = 'pdfocr'
+# Texts can be several MB, expire them so the cache can't fill Redis
+EXTRACTION_CACHE_TIMEOUT = 60 * 60 * 24 * 14  # 2 weeks
+
+# Resolution pages are rasterized at for OCR
+OCR_DPI = 150
+
+# Scanned PDFs with fewer pages use the realtime Gemini endpoint, larger ones the Batch API
+GEMINI_REALTIME_MAX_PAGES = 5
+GEMINI_BATCH_MODEL = 'gemini-2.0-flash'
+BATCH_DONE_STATES = {'JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'}
+# Failed status lookups after which a batch is abandoned for OCR (polled every minute)
+GEMINI_POLL_MAX_FAILURES = 10
+
+EXTRACTION_PROMPT = """Extract all text from this PDF document. 
+Include all text content, maintaining the original structure and formatting as much as possible.
+If this is a scanned document, use OCR to extract the text.
+Return only the extracted text without any additional commentary."""
+
+# Below this many pypdf characters per page the PDF is treated as scanned and sent to Gemini
+MIN_CHARS_PER_PAGE = 200
+
+# S3 client shared by all tasks in a worker process (created on first use)
+_S3_CLIENT = None
+
+# Gemini client for the Batch API (created on first use)
+_GEMINI_CLIENT = None
+
+# Large PDFs are downloaded as parallel 8MB byte-range GETs
+_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10,
+    io_chunksize=256 * 1024,
+    max_io_queue=1000,
+    use_threads=True,
+)
+
+
+def get_s3_client():
+    """
+    Return the process-wide S3 client, creating it on first use.
+    Reusing the client keeps its connection pool (and TLS sessions) across tasks.
+    """
+    global _S3_CLIENT
+    if _S3_CLIENT is None:
+        _S3_CLIENT = boto3.session.Session().client(
+            's3',
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            region_name=settings.AWS_S3_REGION_NAME,
+            config=botocore.config.Config(
+                max_pool_connections=64,
+                retries={'max_attempts': 5, 'mode': 'adaptive'},
+            ),
+        )
+    return _S3_CLIENT
+
+
+def get_gemini_client():
+    """
+    Return the process-wide Gemini client used for Batch API jobs.
+    """
+    global _GEMINI_CLIENT
+    if _GEMINI_CLIENT is None:
+        _GEMINI_CLIENT = GeminiClient(api_key=settings.GEMINI_API_KEY)
+    return _GEMINI_CLIENT
+
+
+@worker_process_init.connect
+def reset_s3_client(**kwargs):
+    # boto3 clients are not fork-safe, each prefork child builds its own
+    global _S3_CLIENT
+    _S3_CLIENT = None
+
+
+# PDFs with at least this many pages are extracted with a process pool
+PARALLEL_EXTRACTION_MIN_PAGES = 20
+
+# PdfReader of the PDF being extracted, one per pool worker process
+_worker_reader = None
+
+
+def open_pdf_mmap(path):
+    """
+    Memory-map a PDF read-only for pypdf.
+    pypdf reads a path into a private in-memory copy, a mapping is backed by the page cache
+    and shared by every process reading the same file.
+    """
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _init_pdf_worker(path):
+    global _worker_reader
+    _worker_reader = pypdf.PdfReader(open_pdf_mmap(path))
+
+
+def _extract_page_text(page_index):
+    return _worker_reader.pages[page_index].extract_text()
+
+
+def extract_pypdf_text(reader, path):
+    """
+    Extract text from every page of a PDF with pypdf.
+    pypdf is pure Python, so large PDFs are spread over a process pool
+    (threads would serialize on the GIL). Falls back to serial extraction.
+    Only called on the prefork cpu worker, the io worker must not fork from its threads.
+    The pool is billiard's: prefork children are daemonic, and multiprocessing refuses to
+    start processes from a daemonic process, billiard does not.
+    """
+    page_count = len(reader.pages)
+    if page_count >= PARALLEL_EXTRACTION_MIN_PAGES:
+        try:
+            workers = min(os.cpu_count() or 1, page_count)
+            with billiard.Pool(
+                processes=workers,
+                initializer=_init_pdf_worker,
+                initargs=(path,)
+            ) as pool:
+                pages = pool.map(
+                    _extract_page_text,
+                    range(page_count),
+                    chunksize=max(1, page_count // (workers * 4))
+                )
+            return "\n".join(pages)
+        except Exception as e:
+            logger.warning(f"Parallel pypdf extraction failed, extracting serially: {e}")
+    
+    return "\n".join(page.extract_text() for page in reader.pages)
+
+
+def download_to_temp_file(doc):
+    """
+    Download the document's PDF from S3 (or local storage if dev) straight into a temp file.
+    Every extraction method reads from this file, no full in-memory copy is kept.
+    Returns the temp file path, the caller is responsible for deleting it.
+    """
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+        try:
+            # Check if using S3 or FileSystem
+            if hasattr(settings, 'AWS_ACCESS_KEY_ID') and settings.AWS_ACCESS_KEY_ID:
+                # We need to get the bucket key. 
+                # If doc.file.name is the full path/key? Yes usually.
+                get_s3_client().download_fileobj(
+                    Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+                    Key=doc.file.name,
+                    Fileobj=tmp_file,
+                    Config=_TRANSFER_CONFIG
+                )
+            else:
+                # Local Dev
+                with doc.file.open('rb') as f:
+                    shutil.copyfileobj(f, tmp_file)
+        except Exception as e:
+            tmp_file.close()
+            os.unlink(tmp_file.name)
+            raise RuntimeError(f"Failed to download file: {str(e)}") from e
+    return tmp_file.name
+
+
+def file_digest(path):
+    """
+    Return a short BLAKE2b content hash of the file at path.
+    """
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+
+
+def get_cached_extraction(digest):
+    """
+    Return the cached extraction result for a content hash, or None on a miss.
+    """
+    try:
+        return cache.get(f'{EXTRACTION_CACHE_PREFIX}:{digest}')
+    except Exception as e:
+        logger.warning(f"Extraction cache lookup failed: {e}")
+        return None
+
+
+def ocr_page(image):
+    """
+    OCR one rasterized page, reusing the cached text when the same page image was seen before.
+    """
+    key = f'{OCR_PAGE_CACHE_PREFIX}:{hashlib.blake2b(image.tobytes(), digest_size=16).hexdigest()}'
+    try:
+        text = cache.get(key)
+    except Exception:
+        text = None
+    if text is None:
+        text = pytesseract.image_to_string(image)
+        try:
+            cache.set(key, text, timeout=EXTRACTION_CACHE_TIMEOUT)
+        except Exception:
+            pass
+    return text
+
+
+def ocr_pdf(path):
+    """
+    OCR every page of the PDF at path, returns the text and the page count.
+    Raises RuntimeError when OCR fails.
+    """
+    try:
+        # poppler rasterizes pages in parallel, 150 DPI JPEGs are plenty for Tesseract
+        # and have about half the pixels of the 200 DPI default
+        images = convert_from_path(
+            path,
+            dpi=OCR_DPI,
+            thread_count=os.cpu_count() or 1,
+            fmt='jpeg',
+            jpegopt={'quality': 85, 'progressive': False, 'optimize': False},
+        )
+        
+        # Each page runs in its own tesseract subprocess, so threads are enough to use all cores
+        # Pages already OCRed in another PDF come from the cache
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            return "\n".join(executor.map(ocr_page, images)), len(images)
+    except Exception as e:
+        logger.error(f"All extraction methods failed: {e}")
+        raise RuntimeError(f"Text extraction failed: {str(e)}") from e
+
+
+def finish_extraction(doc, text, page_count, extraction_method, digest=None):
+    """
+    Save the extracted text and queue embedding generation.
+    When digest is given, the result is also cached for identical uploads.
+    """
+    # Add extraction method to metadata
+    if not doc.meta_data:
+        doc.meta_data = {}
+    doc.meta_data['extraction_method'] = extraction_method
+
+    doc.text_content = text
+    doc.page_count = page_count
+    doc.status = Document.Status.COMPLETED
+    # Save all fields (meta_data may have been set during pypdf extraction)
+    doc.save(update_fields=['text_content', 'page_count', 'status', 'meta_data'])
+    
+    if digest:
+        try:
+            cache.set(f'{EXTRACTION_CACHE_PREFIX}:{digest}', {
+                'text': text,
+                'page_count': page_count,
+                'extraction_method': extraction_method,
+                'meta_data': doc.meta_data,
+            }, timeout=EXTRACTION_CACHE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Failed to cache extraction for document {doc.id}: {e}")
+    
+    # search_vector is a generated column, Postgres updates it with the save above
+    
+    # Generate embeddings for semantic search
+    try:
+        generate_document_embeddings.delay(doc.id)
+    except Exception as e:
+        logger.warning(f"Failed to trigger embedding generation for document {doc.id}: {str(e)}")
+        # Don't fail document processing if embedding generation fails
+
 
 @shared_task
 def process_document(doc_id):
+    """
+    Extract text with pypdf, falling back to Gemini for sparse text (I/O bound, runs on the io queue).
+    Large PDFs are handed to extract_text_pypdf on the cpu queue.
+    Scanned PDFs that still have too little text go to extract_text_ocr.
+    """
+    tmp_file_path = None
     try:
         doc = Document.objects.get(id=doc_id)
         doc.status = Document.Status.PROCESSING
         doc.save(update_fields=['status'])
 
-        # Download file from S3 (or local storage if dev)
-        file_content = None
-        
-        # Check if using S3 or FileSystem
-        if hasattr(settings, 'AWS_ACCESS_KEY_ID') and settings.AWS_ACCESS_KEY_ID:
-            try:
-                s3 = boto3.client('s3', 
-                    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                    region_name=settings.AWS_S3_REGION_NAME
-                )
-                # We need to get the bucket key. 
-                # If doc.file.name is the full path/key? Yes usually.
-                obj = s3.get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=doc.file.name)
-                file_content = obj['Body'].read()
-            except Exception as e:
-                error_msg = f"Failed to download file from S3: {str(e)}"
-                logger.error(error_msg)
-                doc.status = Document.Status.FAILED
-                doc.error_message = error_msg
-                doc.save()
-                return
-        else:
-            # Local Dev
-            try:
-                with doc.file.open('rb') as f:
-                    file_content = f.read()
-            except Exception as e:
-                error_msg = f"Failed to read local file: {str(e)}"
-                logger.error(error_msg)
-                doc.status = Document.Status.FAILED
-                doc.error_message = error_msg
-                doc.save()
-                return
+        # Download failures are saved as FAILED by the except block below
+        tmp_file_path = download_to_temp_file(doc)
+
+        # Same file content was extracted before, reuse it
+        digest = file_digest(tmp_file_path)
+        cached = get_cached_extraction(digest)
+        if cached:
+            logger.info(f"Using cached extraction for document {doc_id}")
+            doc.meta_data = cached['meta_data']
+            finish_extraction(doc, cached['text'], cached['page_count'], cached['extraction_method'])
+            return
 
         text = ""
         page_count = 0
         extraction_method = "unknown"
         
-        # METHOD 1: Try Gemini API for PDF extraction (Best quality, handles scanned PDFs)
+        # METHOD 1: Try pypdf first (native digital PDFs, fast and free)
         try:
-            if settings.GEMINI_API_KEY:
-                logger.info(f"Attempting Gemini API extraction for document {doc_id}")
-                
-                # Save file temporarily for Gemini API
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                    tmp_file.write(file_content)
-                    tmp_file_path = tmp_file.name
+            logger.info("Attempting pypdf extraction")
+            # pypdf seeks within the mapped file instead of loading it into memory
+            with open_pdf_mmap(tmp_file_path) as pdf_file:
+                reader = pypdf.PdfReader(pdf_file)
+                page_count = len(reader.pages)
+                if page_count >= PARALLEL_EXTRACTION_MIN_PAGES:
+                    # Too much CPU work for the io threads, the cpu queue takes it from here
+                    extract_text_pypdf.delay(doc_id, digest)
+                    return
+                text = "\n".join(page.extract_text() for page in reader.pages)
                 
+                # Extract Metadata
+                if reader.metadata:
+                    doc.meta_data = {k: str(v) for k, v in reader.metadata.items()}
+            
+            extraction_method = "pypdf"
+        except Exception as e:
+            logger.warning(f"pypdf failed: {e}")
+        
+        # Little text per page usually means a scanned PDF
+        avg_chars_per_page = len(text.strip()) / max(page_count, 1)
+        
+        # METHOD 2: Fallback to Gemini API (handles scanned PDFs, only when pypdf text is sparse)
+        if avg_chars_per_page < MIN_CHARS_PER_PAGE and settings.GEMINI_API_KEY:
+            if page_count >= GEMINI_REALTIME_MAX_PAGES:
+                # Larger documents go through the Batch API, poll_gemini_batches finishes them
+                if start_gemini_batch(doc, tmp_file_path, page_count, digest):
+                    return
+            else:
+                uploaded_file = None
                 try:
                     # Upload file to Gemini
                     uploaded_file = genai.upload_file(tmp_file_path)
                     
+                    logger.info(f"Attempting Gemini API extraction for document {doc_id}")
                     # Use Gemini 2.0 Flash for PDF processing
                     model = genai.GenerativeModel('gemini-2.0-flash-exp')
-                    
-                    # Extract text with prompt
-                    prompt = """Extract all text from this PDF document. 
-                    Include all text content, maintaining the original structure and formatting as much as possible.
-                    If this is a scanned document, use OCR to extract the text.
-                    Return only the extracted text without any additional commentary."""
-                    
-                    response = model.generate_content([uploaded_file, prompt])
-                    text = response.text
-                    
-                    # Try to get page count from pypdf (faster than Gemini)
-                    try:
-                        pdf_file = io.BytesIO(file_content)
-                        reader = pypdf.PdfReader(pdf_file)
-                        page_count = len(reader.pages)
-                        
-                        # Extract metadata while we have pypdf open
-                        if reader.metadata:
-                            doc.meta_data = {k: str(v) for k, v in reader.metadata.items()}
-                    except:
-                        page_count = 0  # Will estimate from text
-                    
-                    extraction_method = "gemini"
-                    logger.info(f"Gemini extraction successful for document {doc_id}")
-                    
+                    response = model.generate_content([uploaded_file, EXTRACTION_PROMPT])
+                    if response.text.strip():
+                        text = response.text
+                        extraction_method = "gemini"
+                        logger.info(f"Gemini extraction successful for document {doc_id}")
+                            
+                except Exception as e:
+                    logger.warning(f"Gemini extraction failed: {e}. Falling back to OCR")
                 finally:
-                    # Cleanup temp file
-                    if os.path.exists(tmp_file_path):
-                        os.unlink(tmp_file_path)
-                    
-                    # Delete uploaded file from Gemini
-                    try:
-                        genai.delete_file(uploaded_file.name)
-                    except:
-                        pass
-                        
-        except Exception as e:
-            logger.warning(f"Gemini extraction failed: {e}. Falling back to pypdf/OCR")
-        
-        # METHOD 2: Fallback to pypdf (if Gemini failed or no API key)
+                    # Delete uploaded file from Gemini in the background, off the critical path
+                    if uploaded_file is not None:
+                        cleanup_gemini_file.delay(uploaded_file.name)
+        elif extraction_method == "pypdf":
+            logger.info(f"pypdf extraction successful for document {doc_id}")
+            
+        # METHOD 3: Final fallback to OCR (if both pypdf and Gemini failed)
+        # OCR is CPU bound, so it runs as a separate task on the cpu queue
         if not text.strip() or len(text.strip()) < 50:
-            try:
-                logger.info("Attempting pypdf extraction")
-                pdf_file = io.BytesIO(file_content)
+            logger.info(f"Text sparse. Queueing OCR for document {doc_id}.")
+            # The metadata found so far goes with the task instead of a separate save
+            extract_text_ocr.delay(doc_id, doc.meta_data, digest)
+            return
+        
+        finish_extraction(doc, text, page_count, extraction_method, digest)
+
+    except Document.DoesNotExist:
+        logger.error(f"Document {doc_id} not found.")
+    except Exception as e:
+        logger.error(f"Processing failed: {e}")
+        if 'doc' in locals():
+            doc.status = Document.Status.FAILED
+            doc.error_message = str(e)
+            doc.save(update_fields=['status', 'error_message'])
+    finally:
+        # Cleanup temp file
+        if tmp_file_path and os.path.exists(tmp_file_path):
+            os.unlink(tmp_file_path)
+
+
+@shared_task
+def extract_text_pypdf(doc_id, digest):
+    """
+    pypdf extraction of large PDFs over a process pool (CPU bound, runs on the cpu queue).
+    process_document already downloaded the file and checked the extraction cache; the
+    Gemini batch and OCR fallbacks run here on the same download instead of another hand-off.
+    """
+    tmp_file_path = None
+    try:
+        doc = Document.objects.get(id=doc_id)
+        
+        # An identical upload may have been extracted while this task was queued
+        cached = get_cached_extraction(digest)
+        if cached:
+            logger.info(f"Using cached extraction for document {doc_id}")
+            doc.meta_data = cached['meta_data']
+            finish_extraction(doc, cached['text'], cached['page_count'], cached['extraction_method'])
+            return
+        
+        tmp_file_path = download_to_temp_file(doc)
+        
+        text = ""
+        page_count = 0
+        extraction_method = "unknown"
+        try:
+            with open_pdf_mmap(tmp_file_path) as pdf_file:
                 reader = pypdf.PdfReader(pdf_file)
                 page_count = len(reader.pages)
+                text = extract_pypdf_text(reader, tmp_file_path)
                 
-                for page in reader.pages:
-                    text += page.extract_text() + "\n"
-                
-                # Extract Metadata
                 if reader.metadata:
                     doc.meta_data = {k: str(v) for k, v in reader.metadata.items()}
-                
-                extraction_method = "pypdf"
-                logger.info(f"pypdf extraction successful for document {doc_id}")
-            except Exception as e:
-                logger.warning(f"pypdf failed: {e}")
-            
-        # METHOD 3: Final fallback to OCR (if both Gemini and pypdf failed)
-        if not text.strip() or len(text.strip()) < 50:
-            logger.info("Text sparse. Attempting OCR with Tesseract.")
-            try:
-                images = convert_from_bytes(file_content)
-                text = ""
-                page_count = len(images)
-                for image in images:
-                    text += pytesseract.image_to_string(image) + "\n"
-                
-                extraction_method = "ocr"
-                logger.info(f"OCR extraction successful for document {doc_id}")
-            except Exception as e:
-                logger.error(f"All extraction methods failed: {e}")
-                doc.status = Document.Status.FAILED
-                doc.error_message = f"Text extraction failed: {str(e)}"
-                doc.save()
+            extraction_method = "pypdf"
+        except Exception as e:
+            logger.warning(f"pypdf failed: {e}")
+        
+        # Sparse text means a scanned PDF, these have enough pages to always take the Batch API
+        if len(text.strip()) / max(page_count, 1) < MIN_CHARS_PER_PAGE:
+            if settings.GEMINI_API_KEY and start_gemini_batch(doc, tmp_file_path, page_count, digest):
                 return
+            if len(text.strip()) < 50:
+                # Already on the cpu queue with the file downloaded, OCR it right here
+                logger.info(f"Text sparse. Attempting OCR with Tesseract for document {doc_id}.")
+                text, page_count = ocr_pdf(tmp_file_path)
+                extraction_method = "ocr"
         
-        # Add extraction method to metadata
-        if not doc.meta_data:
-            doc.meta_data = {}
-        doc.meta_data['extraction_method'] = extraction_method
+        logger.info(f"{extraction_method} extraction successful for document {doc_id}")
+        finish_extraction(doc, text, page_count, extraction_method, digest)
 
-        doc.text_content = text
+    except Document.DoesNotExist:
+        logger.error(f"Document {doc_id} not found for pypdf extraction.")
+    except Exception as e:
+        logger.error(f"pypdf processing failed: {e}")
+        if 'doc' in locals():
+            doc.status = Document.Status.FAILED
+            doc.error_message = str(e)
+            doc.save(update_fields=['status', 'error_message'])
+    finally:
+        # Cleanup temp file
+        if tmp_file_path and os.path.exists(tmp_file_path):
+            os.unlink(tmp_file_path)
+
+
+def start_gemini_batch(doc, tmp_file_path, page_count, digest):
+    """
+    Upload the PDF and submit it as a Gemini batch job.
+    Returns False when that failed, the caller then falls back to OCR.
+    """
+    uploaded_file = None
+    try:
+        uploaded_file = genai.upload_file(tmp_file_path)
         doc.page_count = page_count
-        doc.status = Document.Status.COMPLETED
-        # Save all fields (meta_data may have been set during pypdf extraction)
-        doc.save(update_fields=['text_content', 'page_count', 'status', 'meta_data'])
-        
-        # Update search vector for full-text search using database query
-        # Include both title and text_content with higher weight on title
-        # This is non-critical - if it fails, document still works, just not searchable
+        submit_gemini_batch(doc, uploaded_file, digest)
+        logger.info(f"Submitted Gemini batch for document {doc.id}")
+        return True
+    except Exception as e:
+        logger.warning(f"Gemini batch submission failed: {e}. Falling back to OCR")
+        # Delete uploaded file from Gemini in the background, off the critical path
+        if uploaded_file is not None:
+            cleanup_gemini_file.delay(uploaded_file.name)
+        return False
+
+
+def submit_gemini_batch(doc, uploaded_file, digest):
+    """
+    Queue the extraction of an uploaded PDF as a Gemini Batch API job.
+    
+    Args:
+        doc: Document being processed
+        uploaded_file: File already uploaded with genai.upload_file
+        digest: Content hash, used to cache the result once the batch finishes
+    """
+    batch = get_gemini_client().batches.create(
+        model=GEMINI_BATCH_MODEL,
+        src=[{
+            'contents': [{
+                'role': 'user',
+                'parts': [
+                    {'file_data': {'file_uri': uploaded_file.uri, 'mime_type': 'application/pdf'}},
+                    {'text': EXTRACTION_PROMPT},
+                ],
+            }],
+        }],
+        config={'display_name': f'document-{doc.id}'},
+    )
+    
+    if not doc.meta_data:
+        doc.meta_data = {}
+    doc.meta_data['content_hash'] = digest
+    doc.gemini_batch_name = batch.name
+    doc.gemini_file_name = uploaded_file.name
+    doc.save(update_fields=['meta_data', 'page_count', 'gemini_batch_name', 'gemini_file_name'])
+
+
+@shared_task
+def poll_gemini_batches():
+    """
+    Periodic task: finish documents whose Gemini batch job is done.
+    Failed or sparse batch results fall back to OCR.
+    """
+    if not settings.GEMINI_API_KEY:
+        return
+    
+    client = get_gemini_client()
+    pending = Document.objects.filter(status=Document.Status.PROCESSING).exclude(gemini_batch_name='')
+    for doc in pending.defer('text_content'):
+        batch_name = doc.gemini_batch_name
         try:
-            Document.objects.filter(id=doc.id).update(
-                search_vector=SearchVector('title', weight='A', config='english') + SearchVector('text_content', weight='B', config='english')
+            text = ""
+            try:
+                batch = client.batches.get(name=batch_name)
+            except Exception as e:
+                # Deleted or expired batches and auth errors never recover, give up eventually
+                failures = doc.meta_data.get('gemini_poll_failures', 0) + 1
+                if failures < GEMINI_POLL_MAX_FAILURES:
+                    logger.warning(f"Polling Gemini batch for document {doc.id} failed ({failures}): {e}")
+                    doc.meta_data['gemini_poll_failures'] = failures
+                    doc.save(update_fields=['meta_data'])
+                    continue
+                logger.error(f"Polling Gemini batch for document {doc.id} failed {failures} times: {e}")
+                state = 'poll failures'
+            else:
+                state = batch.state.name
+                if state not in BATCH_DONE_STATES:
+                    continue
+                
+                if state == 'JOB_STATE_SUCCEEDED' and batch.dest and batch.dest.inlined_responses:
+                    result = batch.dest.inlined_responses[0]
+                    if result.response is not None:
+                        text = result.response.text or ""
+            
+            # Claim the document, an overlapping poll run may already be finishing it
+            claimed = Document.objects.filter(id=doc.id, gemini_batch_name=batch_name).update(
+                gemini_batch_name='', gemini_file_name=''
             )
+            if not claimed:
+                continue
+            
+            cleanup_gemini_file.delay(doc.gemini_file_name)
+            doc.gemini_batch_name = ''
+            doc.gemini_file_name = ''
+            doc.meta_data.pop('gemini_poll_failures', None)
+            digest = doc.meta_data.get('content_hash')
+            
+            if not text.strip() or len(text.strip()) < 50:
+                logger.warning(f"Gemini batch for document {doc.id} ended with {state}. Queueing OCR.")
+                extract_text_ocr.delay(doc.id, doc.meta_data, digest)
+                continue
+            
+            logger.info(f"Gemini batch extraction successful for document {doc.id}")
+            finish_extraction(doc, text, doc.page_count, "gemini", digest)
         except Exception as e:
-            # Log warning but don't fail document processing
-            logger.warning(f"Failed to update search vector for document {doc_id}: {str(e)}")
-            # Document is still marked as COMPLETED and will work, just won't be searchable
+            logger.error(f"Finishing Gemini batch for document {doc.id} failed: {e}")
+
+
+@shared_task(ignore_result=True)
+def cleanup_gemini_file(name):
+    """
+    Delete a file uploaded to Gemini (runs on the low priority queue).
+    """
+    try:
+        genai.delete_file(name)
+    except Exception as e:
+        logger.warning(f"Failed to delete Gemini file {name}: {e}")
+
+
+@shared_task
+def extract_text_ocr(doc_id, meta_data=None, digest=None):
+    """
+    Final extraction fallback: OCR with Tesseract (CPU bound, runs on the cpu queue).
+    meta_data and digest are what process_document already found, so they are not saved
+    or computed twice.
+    """
+    tmp_file_path = None
+    try:
+        doc = Document.objects.get(id=doc_id)
+        if meta_data is not None:
+            doc.meta_data = meta_data
+        tmp_file_path = download_to_temp_file(doc)
         
-        # Generate embeddings for semantic search
-        try:
-            generate_document_embeddings.delay(doc_id)
-        except Exception as e:
-            logger.warning(f"Failed to trigger embedding generation for document {doc_id}: {str(e)}")
-            # Don't fail document processing if embedding generation fails
+        logger.info(f"Attempting OCR with Tesseract for document {doc_id}.")
+        text, page_count = ocr_pdf(tmp_file_path)
+        logger.info(f"OCR extraction successful for document {doc_id}")
+        
+        finish_extraction(doc, text, page_count, "ocr", digest or file_digest(tmp_file_path))
 
     except Document.DoesNotExist:
-        logger.error(f"Document {doc_id} not found.")
+        logger.error(f"Document {doc_id} not found for OCR.")
     except Exception as e:
-        logger.error(f"Processing failed: {e}")
+        logger.error(f"OCR processing failed: {e}")
         if 'doc' in locals():
             doc.status = Document.Status.FAILED
             doc.error_message = str(e)
-            doc.save()
+            doc.save(update_fields=['status', 'error_message'])
+    finally:
+        # Cleanup temp file
+        if tmp_file_path and os.path.exists(tmp_file_path):
+            os.unlink(tmp_file_path)
 
 
 @shared_task
@@ -219,9 +635,6 @@ def generate_document_embeddings(doc_id):
         doc.embedding_status = Document.EmbeddingStatus.PROCESSING
         doc.save(update_fields=['embedding_status'])
         
-        # Delete existing chunks if any
-        DocumentChunk.objects.filter(document=doc).delete()
-        
         # Chunk the text
         chunks = chunk_text(doc.text_content)
         
@@ -231,30 +644,29 @@ def generate_document_embeddings(doc_id):
             doc.save(update_fields=['embedding_status'])
             return
         
-        # Generate embeddings for each chunk
-        chunk_objects = []
-        for idx, chunk_text_content in enumerate(chunks):
-            try:
-                # Generate embedding
-                embedding = generate_embedding(chunk_text_content)
-                
-                # Create chunk object
-                chunk = DocumentChunk(
-                    document=doc,
-                    chunk_text=chunk_text_content,
-                    chunk_index=idx,
-                    embedding=embedding
-                )
-                chunk_objects.append(chunk)
-                
-            except Exception as e:
-                logger.error(f"Error generating embedding for chunk {idx} of document {doc_id}: {str(e)}")
-                # Continue with other chunks even if one fails
-                continue
+        # Generate embeddings for all chunks, batched into few API round trips
+        try:
+            embeddings = generate_embeddings_batch(chunks)
+        except Exception as e:
+            logger.error(f"Error generating embeddings for document {doc_id}: {str(e)}")
+            embeddings = []
+        
+        chunk_objects = [
+            DocumentChunk(
+                document=doc,
+                chunk_text=chunk_text_content,
+                chunk_index=idx,
+                embedding=embedding
+            )
+            for idx, (chunk_text_content, embedding) in enumerate(zip(chunks, embeddings))
+        ]
         
-        # Bulk create chunks
+        # Replace existing chunks and bulk insert the new ones with a single COPY statement
+        # in one transaction, so searches never see a document with missing chunks
         if chunk_objects:
-            DocumentChunk.objects.bulk_create(chunk_objects)
+            with transaction.atomic():
+                DocumentChunk.objects.filter(document=doc).delete()
+                copy_chunks(chunk_objects)
             doc.embedding_status = Document.EmbeddingStatus.COMPLETED
             logger.info(f"Successfully generated {len(chunk_objects)} embeddings for document {doc_id}")
         else:
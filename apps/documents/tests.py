@@ -1,3 +1,289 @@
-from django.test import TestCase
+import contextlib
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import billiard
+import pypdf
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, storages
+from django.db import DatabaseError
+from django.test import SimpleTestCase, override_settings
+
+from .management.commands.delete_old_documents import delete_local_file
+from .models import Document, DocumentChunk
+from .services import _copy_escape, chunk_text, copy_chunks, find_similar_chunks
+from .tasks import (
+    GEMINI_POLL_MAX_FAILURES, PARALLEL_EXTRACTION_MIN_PAGES, extract_pypdf_text, extract_text_pypdf,
+    open_pdf_mmap, poll_gemini_batches,
+)
+
+
+class DeleteLocalFileTests(SimpleTestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_existing_file_is_deleted(self):
+        name = default_storage.save('documents/report.pdf', ContentFile(b'%PDF-1.4'))
+        self.assertIsNone(delete_local_file(storages['default'], name))
+        self.assertFalse(os.path.exists(default_storage.path(name)))
+
+    def test_missing_file_is_reported(self):
+        self.assertEqual(delete_local_file(storages['default'], 'documents/missing.pdf'), 'File not found')
+
+
+class WhitespaceEncoding:
+    """Stands in for the tiktoken encoding, one token per word."""
+
+    def encode_ordinary(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return ' '.join(tokens)
+
+
+@mock.patch('apps.documents.services.tiktoken.get_encoding', return_value=WhitespaceEncoding())
+class ChunkTextTests(SimpleTestCase):
+    def words(self, count):
+        return [f'w{i}' for i in range(count)]
+
+    def test_short_text_is_one_chunk(self, get_encoding):
+        text = ' '.join(self.words(10))
+        self.assertEqual(chunk_text(text, chunk_size=10, overlap=3), [text])
+
+    def test_windows_overlap(self, get_encoding):
+        words = self.words(24)
+        chunks = chunk_text(' '.join(words), chunk_size=10, overlap=3)
+        self.assertEqual(chunks, [
+            ' '.join(words[0:10]),
+            ' '.join(words[7:17]),
+            ' '.join(words[14:24]),
+        ])
+
+    def test_no_tail_chunk_inside_the_overlap(self, get_encoding):
+        # The second window already ends at the last token
+        words = self.words(17)
+        chunks = chunk_text(' '.join(words), chunk_size=10, overlap=3)
+        self.assertEqual(chunks, [' '.join(words[0:10]), ' '.join(words[7:17])])
+
+    def test_blank_text(self, get_encoding):
+        self.assertEqual(chunk_text('  \n'), [])
+
+
+def make_text_pdf(path, page_count):
+    """Write a PDF whose page i only contains the text 'Page i'."""
+    writer = pypdf.PdfWriter()
+    font = DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+    })
+    for i in range(page_count):
+        page = writer.add_blank_page(612, 792)
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+        })
+        content = DecodedStreamObject()
+        content.set_data(f'BT /F1 12 Tf 72 720 Td (Page {i}) Tj ET'.encode())
+        page.replace_contents(content)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+def extract_without_fallback(path):
+    """Run extract_pypdf_text, failing if it fell back to serial extraction."""
+    with mock.patch('apps.documents.tasks.logger.warning') as warning:
+        with open_pdf_mmap(path) as pdf_file:
+            text = extract_pypdf_text(pypdf.PdfReader(pdf_file), path)
+    if warning.called:
+        raise AssertionError(warning.call_args)
+    return text
+
+
+class ExtractPypdfTextTests(SimpleTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, 'doc.pdf')
+        self.page_count = PARALLEL_EXTRACTION_MIN_PAGES + 5
+        make_text_pdf(self.path, self.page_count)
+        self.expected = '\n'.join(f'Page {i}' for i in range(self.page_count))
+
+    def test_large_pdf_uses_the_process_pool(self):
+        with mock.patch('apps.documents.tasks.billiard.Pool', wraps=billiard.Pool) as pool:
+            self.assertEqual(extract_without_fallback(self.path), self.expected)
+        pool.assert_called_once()
+
+    def test_process_pool_starts_in_a_daemonic_worker(self):
+        # Prefork worker children are daemonic billiard processes
+        with billiard.Pool(1) as worker:
+            self.assertEqual(worker.apply(extract_without_fallback, (self.path,)), self.expected)
+
+    def test_small_pdf_is_extracted_serially(self):
+        make_text_pdf(self.path, 3)
+        with mock.patch('apps.documents.tasks.billiard.Pool') as pool:
+            self.assertEqual(extract_without_fallback(self.path), 'Page 0\nPage 1\nPage 2')
+        pool.assert_not_called()
+
+
+@override_settings(GEMINI_API_KEY='')
+class ExtractTextPypdfTaskTests(SimpleTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.source = os.path.join(tmp_dir.name, 'source.pdf')
+        # No text layer, like a scanned PDF
+        writer = pypdf.PdfWriter()
+        for _ in range(PARALLEL_EXTRACTION_MIN_PAGES):
+            writer.add_blank_page(612, 792)
+        with open(self.source, 'wb') as f:
+            writer.write(f)
+        self.download = os.path.join(tmp_dir.name, 'download.pdf')
+        self.doc = mock.Mock(id=1, meta_data={})
+        for target, kwargs in [
+            ('apps.documents.tasks.Document.objects.get', {'return_value': self.doc}),
+            ('apps.documents.tasks.download_to_temp_file', {'side_effect': self.fake_download}),
+            ('apps.documents.tasks.get_cached_extraction', {'return_value': None}),
+            ('apps.documents.tasks.finish_extraction', {}),
+            ('apps.documents.tasks.process_document', {}),
+            ('apps.documents.tasks.ocr_pdf', {'return_value': ('scanned text', 20)}),
+        ]:
+            patcher = mock.patch(target, **kwargs)
+            setattr(self, target.rsplit('.', 1)[1], patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def fake_download(self, doc):
+        # The task deletes its download when done
+        shutil.copy(self.source, self.download)
+        return self.download
+
+    def test_sparse_text_is_ocred_on_the_same_download(self):
+        extract_text_pypdf(1, 'digest')
+        self.download_to_temp_file.assert_called_once()
+        self.ocr_pdf.assert_called_once_with(self.download)
+        self.finish_extraction.assert_called_once_with(self.doc, 'scanned text', 20, 'ocr', 'digest')
+        self.process_document.delay.assert_not_called()
+        self.assertFalse(os.path.exists(self.download))
+
+    def test_cached_extraction_skips_the_download(self):
+        self.get_cached_extraction.return_value = {
+            'text': 'cached', 'page_count': 20, 'extraction_method': 'pypdf', 'meta_data': {},
+        }
+        extract_text_pypdf(1, 'digest')
+        self.download_to_temp_file.assert_not_called()
+        self.finish_extraction.assert_called_once_with(self.doc, 'cached', 20, 'pypdf')
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+class PollGeminiBatchesTests(SimpleTestCase):
+    def setUp(self):
+        self.doc = mock.Mock(
+            id=1,
+            gemini_batch_name='batches/1',
+            gemini_file_name='files/1',
+            meta_data={'content_hash': 'digest'},
+            page_count=10,
+        )
+        self.objects = mock.MagicMock()
+        self.objects.filter.return_value.exclude.return_value.defer.return_value = [self.doc]
+        self.claim = self.objects.filter.return_value.update
+        self.claim.return_value = 1
+        self.client = mock.Mock()
+        self.batch = self.client.batches.get.return_value
+        self.batch.state.name = 'JOB_STATE_SUCCEEDED'
+        self.batch.dest.inlined_responses = [mock.Mock(response=mock.Mock(text='extracted ' * 10))]
+        for name, patcher in [
+            ('objects', mock.patch.object(Document, 'objects', self.objects)),
+            ('get_gemini_client', mock.patch('apps.documents.tasks.get_gemini_client', return_value=self.client)),
+            ('finish_extraction', mock.patch('apps.documents.tasks.finish_extraction')),
+            ('cleanup_gemini_file', mock.patch('apps.documents.tasks.cleanup_gemini_file')),
+            ('extract_text_ocr', mock.patch('apps.documents.tasks.extract_text_ocr')),
+        ]:
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_finished_batch_is_claimed_then_finished(self):
+        poll_gemini_batches()
+        self.objects.filter.assert_called_with(id=1, gemini_batch_name='batches/1')
+        self.claim.assert_called_once_with(gemini_batch_name='', gemini_file_name='')
+        self.cleanup_gemini_file.delay.assert_called_once_with('files/1')
+        self.finish_extraction.assert_called_once_with(self.doc, 'extracted ' * 10, 10, 'gemini', 'digest')
+
+    def test_batch_claimed_by_another_run_is_skipped(self):
+        self.claim.return_value = 0
+        poll_gemini_batches()
+        self.cleanup_gemini_file.delay.assert_not_called()
+        self.finish_extraction.assert_not_called()
+        self.extract_text_ocr.delay.assert_not_called()
+
+    def test_running_batch_is_left_alone(self):
+        self.batch.state.name = 'JOB_STATE_RUNNING'
+        poll_gemini_batches()
+        self.claim.assert_not_called()
+        self.finish_extraction.assert_not_called()
+
+    def test_failed_lookup_is_counted(self):
+        self.client.batches.get.side_effect = RuntimeError('404 batch not found')
+        with self.assertLogs('apps.documents.tasks', 'WARNING'):
+            poll_gemini_batches()
+        self.assertEqual(self.doc.meta_data['gemini_poll_failures'], 1)
+        self.doc.save.assert_called_once_with(update_fields=['meta_data'])
+        self.claim.assert_not_called()
+
+    def test_gives_up_for_ocr_after_max_failures(self):
+        self.client.batches.get.side_effect = RuntimeError('404 batch not found')
+        self.doc.meta_data['gemini_poll_failures'] = GEMINI_POLL_MAX_FAILURES - 1
+        with self.assertLogs('apps.documents.tasks', 'ERROR'):
+            poll_gemini_batches()
+        self.claim.assert_called_once_with(gemini_batch_name='', gemini_file_name='')
+        self.extract_text_ocr.delay.assert_called_once_with(1, {'content_hash': 'digest'}, 'digest')
+        self.finish_extraction.assert_not_called()
+
+
+class CopyChunksTests(SimpleTestCase):
+    def test_copy_escape(self):
+        self.assertEqual(_copy_escape('a\tb\nc\\d\re'), 'a\\tb\\nc\\\\d\\re')
+
+    def test_rows_are_escaped_for_copy(self):
+        chunks = [
+            DocumentChunk(document_id=1, chunk_index=0, chunk_text='tab\there\nnew line', embedding=[0.5, -1.25]),
+            DocumentChunk(document_id=1, chunk_index=1, chunk_text='back\\slash', embedding=None),
+        ]
+        cursor = mock.MagicMock()
+        rows = []
+        cursor.copy_expert.side_effect = lambda sql, buffer: rows.extend(buffer.read().splitlines())
+        connection = mock.Mock(vendor='postgresql')
+        connection.cursor.return_value.__enter__ = mock.Mock(return_value=cursor)
+        connection.cursor.return_value.__exit__ = mock.Mock(return_value=False)
+        with mock.patch('apps.documents.services.connection', connection):
+            self.assertEqual(copy_chunks(chunks), 2)
+        
+        self.assertEqual([row.split('\t')[:4] for row in rows], [
+            ['1', '0', 'tab\\there\\nnew line', '[0.5,-1.25]'],
+            ['1', '1', 'back\\\\slash', '\\N'],
+        ])
+
+    def test_other_databases_fall_back_to_bulk_create(self):
+        chunks = [DocumentChunk(document_id=1, chunk_index=0, chunk_text='text')]
+        with mock.patch('apps.documents.services.connection', mock.Mock(vendor='sqlite')), \
+                mock.patch.object(DocumentChunk, 'objects') as objects:
+            self.assertEqual(copy_chunks(chunks), 1)
+        objects.bulk_create.assert_called_once_with(chunks, batch_size=500)
+
+
+class FindSimilarChunksTests(SimpleTestCase):
+    def test_database_error_returns_no_results(self):
+        connection = mock.Mock(vendor='postgresql')
+        connection.cursor.side_effect = DatabaseError('unrecognized configuration parameter "hnsw.iterative_scan"')
+        with mock.patch('apps.documents.services.connection', connection), \
+                mock.patch('apps.documents.services.transaction.atomic', contextlib.nullcontext), \
+                self.assertLogs('apps.documents.services', 'ERROR') as logs:
+            self.assertEqual(find_similar_chunks([0.1] * 768, mock.Mock(id=1)), [])
+        self.assertIn('pgvector 0.8+', logs.output[0])
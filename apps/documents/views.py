@@ -1,5 +1,8 @@
+import json
 from rest_framework import generics, permissions, filters, status
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from django.contrib.postgres.search import SearchQuery, SearchRank
 from django.views.generic import TemplateView, CreateView, ListView, DetailView
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -8,17 +11,20 @@ from django.urls import reverse_lazy
 from django.db.models import F
 from django.core.exceptions import ValidationError
 from django.views import View
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 import google.generativeai as genai
 from django.conf import settings
 from .models import Document
-from .serializers import DocumentSerializer
+from .serializers import DocumentSerializer, DocumentListSerializer
 from .tasks import process_document
 from .services import generate_query_embedding, find_similar_chunks
 
 # Maximum file size: 50MB
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 52,428,800 bytes
 
+# Shared by all QnA requests (Gemini is configured in DocumentsConfig.ready())
+_QNA_MODEL = genai.GenerativeModel('gemini-2.5-flash')
+
 # --- API Views ---
 class DocumentListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = DocumentSerializer
@@ -26,8 +32,21 @@ class DocumentListCreateAPIView(generics.ListCreateAPIView):
     filter_backends = [filters.SearchFilter]
     search_fields = ['title', 'text_content']
 
+    @property
+    def pagination_class(self):
+        # Ranked search results are ordered by rank, not created_at, so they can't use a cursor
+        if self.request.query_params.get('search'):
+            return PageNumberPagination
+        return api_settings.DEFAULT_PAGINATION_CLASS
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return DocumentListSerializer
+        return DocumentSerializer
+
     def get_queryset(self):
-        queryset = Document.objects.filter(user=self.request.user)
+        # List responses don't include the extracted text or the tsvector, so don't fetch them
+        queryset = Document.objects.filter(user=self.request.user).defer('text_content', 'search_vector')
         search_query = self.request.query_params.get('search', None)
         
         if search_query:
@@ -87,6 +106,7 @@ class DocumentUploadView(LoginRequiredMixin, CreateView):
                 errors.append(f"Only PDF files are allowed. Received: {file.content_type}")
         
         # 4. Check PDF magic bytes (most reliable check)
+        # Only the 4 header bytes are read, the upload itself stays in its temp file
         if file.size > 0:
             current_position = file.tell()
             file.seek(0)
@@ -126,7 +146,8 @@ class DocumentListView(LoginRequiredMixin, ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        queryset = Document.objects.filter(user=self.request.user)
+        # The list page never shows the extracted text or the tsvector, so don't fetch (and detoast) them
+        queryset = Document.objects.filter(user=self.request.user).defer('text_content', 'search_vector')
         search_query = self.request.GET.get('q')
         
         if search_query:
@@ -167,18 +188,16 @@ class SemanticSearchView(LoginRequiredMixin, TemplateView):
                 # Group by document and get unique documents
                 documents_dict = {}
                 for chunk in similar_chunks:
-                    doc = chunk.document
-                    if doc.id not in documents_dict:
-                        documents_dict[doc.id] = {
-                            'document': doc,
+                    if chunk.document_id not in documents_dict:
+                        documents_dict[chunk.document_id] = {
+                            'document': chunk.document,
                             'chunks': [],
                             'max_similarity': 0
                         }
-                    documents_dict[doc.id]['chunks'].append(chunk)
+                    documents_dict[chunk.document_id]['chunks'].append(chunk)
                     # Update max similarity
-                    similarity = getattr(chunk, 'similarity_score', 0)
-                    if similarity > documents_dict[doc.id]['max_similarity']:
-                        documents_dict[doc.id]['max_similarity'] = similarity
+                    if chunk.similarity_score > documents_dict[chunk.document_id]['max_similarity']:
+                        documents_dict[chunk.document_id]['max_similarity'] = chunk.similarity_score
                 
                 # Convert to list and sort by similarity
                 results = list(documents_dict.values())
@@ -216,25 +235,22 @@ class QnAView(LoginRequiredMixin, TemplateView):
                 
                 # Prepare context for Gemini
                 context_texts = []
-                source_docs_set = set()
+                source_docs_by_id = {}
                 
                 for chunk in similar_chunks:
                     context_texts.append(chunk.chunk_text)
-                    source_docs_set.add(chunk.document)
+                    source_docs_by_id.setdefault(chunk.document_id, chunk.document)
                     source_texts.append({
                         'document': chunk.document,
                         'text': chunk.chunk_text[:500] + '...' if len(chunk.chunk_text) > 500 else chunk.chunk_text,
-                        'similarity': getattr(chunk, 'similarity_score', 0)
+                        'similarity': chunk.similarity_score
                     })
                 
                 # Combine context
-                combined_context = "\n\n".join([f"Document excerpt {i+1}:\n{text}" for i, text in enumerate(context_texts)])
+                combined_context = "\n\n".join(f"Document excerpt {i+1}:\n{text}" for i, text in enumerate(context_texts))
                 
                 # Generate answer using Gemini
                 if settings.GEMINI_API_KEY:
-                    genai.configure(api_key=settings.GEMINI_API_KEY)
-                    model = genai.GenerativeModel('gemini-2.5-flash')
-                    
                     prompt = f"""Based on the following document excerpts, please answer the question. 
 If the answer cannot be found in the excerpts, say so.
 
@@ -245,11 +261,11 @@ Document excerpts:
 
 Answer:"""
                     
-                    response = model.generate_content(prompt)
+                    response = _QNA_MODEL.generate_content(prompt)
                     answer = response.text
                     
                     # Get source documents
-                    source_documents = list(source_docs_set)
+                    source_documents = list(source_docs_by_id.values())
                 else:
                     context['error'] = "Gemini API key not configured."
                     return context
@@ -266,51 +282,57 @@ Answer:"""
 
 
 class QnAAPIView(LoginRequiredMixin, View):
-    """API endpoint for QnA (for AJAX requests)"""
+    """
+    API endpoint for QnA (for AJAX requests).
+    Returns JSON by default. With stream=1 the answer is streamed as newline delimited
+    JSON instead: first a line with the sources, then one {"answer": ...} line per chunk
+    of text Gemini generates.
+    """
     
     def post(self, request):
         question = request.POST.get('question', '')
+        stream = request.POST.get('stream', '') in ('1', 'true')
         
         if not question:
             return JsonResponse({'error': 'Question is required'}, status=400)
         
+        if not settings.GEMINI_API_KEY:
+            return JsonResponse({'error': 'Gemini API key not configured'}, status=500)
+        
         try:
             # Generate query embedding
             query_embedding = generate_query_embedding(question)
             
             # Find top-k similar chunks
             similar_chunks = find_similar_chunks(query_embedding, request.user, limit=5)
-            
-            if not similar_chunks:
-                return JsonResponse({
-                    'answer': 'No relevant information found in your documents.',
-                    'sources': []
-                })
-            
-            # Prepare context
-            context_texts = []
-            source_docs = []
-            source_texts = []
-            
-            for chunk in similar_chunks:
-                context_texts.append(chunk.chunk_text)
-                if chunk.document not in source_docs:
-                    source_docs.append(chunk.document)
-                source_texts.append({
-                    'document_id': chunk.document.id,
-                    'document_title': chunk.document.title,
-                    'text': chunk.chunk_text[:500] + '...' if len(chunk.chunk_text) > 500 else chunk.chunk_text,
-                    'similarity': getattr(chunk, 'similarity_score', 0)
-                })
-            
-            # Generate answer
-            combined_context = "\n\n".join([f"Document excerpt {i+1}:\n{text}" for i, text in enumerate(context_texts)])
-            
-            if settings.GEMINI_API_KEY:
-                genai.configure(api_key=settings.GEMINI_API_KEY)
-                model = genai.GenerativeModel('gemini-2.5-flash')
-                
-                prompt = f"""Based on the following document excerpts, please answer the question. 
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+        
+        if not similar_chunks:
+            return JsonResponse({
+                'answer': 'No relevant information found in your documents.',
+                'sources': []
+            })
+        
+        # Prepare context
+        context_texts = []
+        source_docs_by_id = {}
+        source_texts = []
+        
+        for chunk in similar_chunks:
+            context_texts.append(chunk.chunk_text)
+            source_docs_by_id.setdefault(chunk.document_id, chunk.document)
+            source_texts.append({
+                'document_id': chunk.document_id,
+                'document_title': chunk.document_title,
+                'text': chunk.chunk_text[:500] + '...' if len(chunk.chunk_text) > 500 else chunk.chunk_text,
+                'similarity': chunk.similarity_score
+            })
+        
+        # Generate answer
+        combined_context = "\n\n".join(f"Document excerpt {i+1}:\n{text}" for i, text in enumerate(context_texts))
+        
+        prompt = f"""Based on the following document excerpts, please answer the question. 
 If the answer cannot be found in the excerpts, say so.
 
 Question: {question}
@@ -319,24 +341,35 @@ Document excerpts:
 {combined_context}
 
 Answer:"""
-                
-                response = model.generate_content(prompt)
-                answer = response.text
-                
-                return JsonResponse({
-                    'answer': answer,
-                    'sources': [
-                        {
-                            'id': doc.id,
-                            'title': doc.title,
-                            'url': f'/documents/{doc.id}/'
-                        }
-                        for doc in source_docs
-                    ],
-                    'source_texts': source_texts
-                })
-            else:
-                return JsonResponse({'error': 'Gemini API key not configured'}, status=500)
-                
-        except Exception as e:
-            return JsonResponse({'error': str(e)}, status=500)
+        
+        sources = [
+            {
+                'id': doc.id,
+                'title': doc.title,
+                'url': f'/documents/{doc.id}/'
+            }
+            for doc in source_docs_by_id.values()
+        ]
+        
+        if not stream:
+            try:
+                response = _QNA_MODEL.generate_content(prompt)
+            except Exception as e:
+                return JsonResponse({'error': str(e)}, status=500)
+            return JsonResponse({
+                'answer': response.text,
+                'sources': sources,
+                'source_texts': source_texts
+            })
+        
+        def stream_answer():
+            # Sources are known before Gemini answers, send them right away
+            yield json.dumps({'sources': sources, 'source_texts': source_texts}) + '\n'
+            try:
+                for part in _QNA_MODEL.generate_content(prompt, stream=True):
+                    yield json.dumps({'answer': part.text}) + '\n'
+            except Exception as e:
+                yield json.dumps({'error': str(e)}) + '\n'
+        
+        # A sync generator is sent chunk by chunk by WSGI servers, an async one is buffered
+        return StreamingHttpResponse(stream_answer(), content_type='application/x-ndjson')
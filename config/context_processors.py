@@ -0,0 +1,8 @@
+from django.conf import settings
+
+
+def google_oauth(request):
+    """
+    Tell templates whether Google login is configured (allauth.socialaccount is installed).
+    """
+    return {'google_oauth_enabled': settings.GOOGLE_OAUTH_ENABLED}
@@ -2,19 +2,36 @@
 from pathlib import Path
 import os
 import dj_database_url
-from dotenv import load_dotenv
 
 BASE_DIR = Path(__file__).resolve().parent.parent
+# Plain string paths for the settings below (Django uses them as str anyway)
+_BD = str(BASE_DIR)
 
-# Load .env file - try explicit path first, then default location
-load_dotenv(BASE_DIR / '.env')  # Explicit path
-load_dotenv()  # Also try default location
+# Load .env file, unless the environment is already provided (e.g. docker-compose env_file)
+if os.environ.get('DJANGO_SKIP_DOTENV') != '1':
+    try:
+        # Written by `manage.py compile_env`, a plain import instead of parsing .env
+        from config._env_compiled import ENV as _COMPILED_ENV
+    except ImportError:
+        from dotenv import load_dotenv
+        load_dotenv(f'{_BD}/.env')
+    else:
+        # Like load_dotenv, variables already in the environment win
+        for _key, _value in _COMPILED_ENV.items():
+            os.environ.setdefault(_key, _value)
 
-SECRET_KEY = os.getenv('SECRET_KEY', 'django-insecure-test-key')
+# Environment, read once
+_E = os.environ
 
-DEBUG = os.getenv('DEBUG', 'True') == 'True'
+SECRET_KEY = _E.get('SECRET_KEY', 'django-insecure-test-key')
 
-ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',')
+# Values accepted as true for boolean environment variables (compared lowercased)
+_TRUE = frozenset({'1', 'true', 'yes', 'on'})
+
+DEBUG = _E.get('DEBUG', 'True').strip().lower() in _TRUE
+
+# Comma separated, whitespace around entries ("a, b") is ignored
+ALLOWED_HOSTS = [h.strip() for h in _E.get('ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',') if h.strip()]
 
 
 # Application definition
@@ -32,16 +49,22 @@ INSTALLED_APPS = [
     'rest_framework',
     'allauth',
     'allauth.account',
-    'allauth.socialaccount',
-    'allauth.socialaccount.providers.google',
-    'storages',
 
     # Local
     'apps.documents',
 ]
 
+# Optional integrations, only loaded when configured
+_GOOGLE_CLIENT_ID = _E.get('GOOGLE_OAUTH_CLIENT_ID', '')
+_GOOGLE_SECRET = _E.get('GOOGLE_OAUTH_CLIENT_SECRET', '')
+GOOGLE_OAUTH_ENABLED = bool(_GOOGLE_CLIENT_ID and _GOOGLE_SECRET)
+if GOOGLE_OAUTH_ENABLED:
+    INSTALLED_APPS += ['allauth.socialaccount', 'allauth.socialaccount.providers.google']
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Compress HTML/JSON responses (above everything that reads or changes the body)
+    'django.middleware.gzip.GZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -53,16 +76,24 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'config.urls'
 
+# Every URL pattern ends with '/', CommonMiddleware only does its extra resolve for
+# paths without one and redirects them (e.g. /dashboard -> /dashboard/)
+APPEND_SLASH = True
+PREPEND_WWW = False
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [BASE_DIR / 'templates'],
+        'DIRS': [f'{_BD}/templates'],
+        # No 'loaders' on purpose: Django then wraps the filesystem and app directories
+        # loaders in cached.Loader, so each template is compiled once per process
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'config.context_processors.google_oauth',
             ],
         },
     },
@@ -74,8 +105,11 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 DATABASES = {
     'default': dj_database_url.config(
-        default=os.getenv('DATABASE_URL', 'sqlite:///db.sqlite3'),
-        conn_max_age=600
+        default=_E.get('DATABASE_URL', 'sqlite:///db.sqlite3'),
+        conn_max_age=600,
+        # Check persistent connections before reuse, so a dropped one reconnects
+        # instead of failing the request
+        conn_health_checks=True,
     )
 }
 
@@ -106,11 +140,16 @@ USE_TZ = True
 
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = 'static/'
-STATIC_ROOT = BASE_DIR / 'staticfiles'
+STATIC_ROOT = f'{_BD}/staticfiles'
 
 # Media
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_ROOT = f'{_BD}/media'
+
+# Uploads are always streamed to a temp file on disk instead of being buffered in memory
+# (set FILE_UPLOAD_TEMP_DIR to e.g. /dev/shm to keep them off the disk)
+FILE_UPLOAD_MAX_MEMORY_SIZE = 0
+FILE_UPLOAD_TEMP_DIR = _E.get('FILE_UPLOAD_TEMP_DIR') or None
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -123,38 +162,40 @@ AUTHENTICATION_BACKENDS = [
 
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'account_login'
-ACCOUNT_LOGIN_METHODS = {'email'}
+ACCOUNT_LOGIN_METHODS = frozenset({'email'})
 ACCOUNT_EMAIL_VERIFICATION = 'none'  # For MVP
 ACCOUNT_USERNAME_REQUIRED = False
 
 # Social Account (Google OAuth) Settings
 # Credentials are loaded from environment variables - no need for Django Admin setup!
-SOCIALACCOUNT_PROVIDERS = {
-    'google': {
-        'SCOPE': [
-            'profile',
-            'email',
-        ],
-        'AUTH_PARAMS': {
-            'access_type': 'online',
-        },
-        'APP': {
-            'client_id': os.getenv('GOOGLE_OAUTH_CLIENT_ID', ''),
-            'secret': os.getenv('GOOGLE_OAUTH_CLIENT_SECRET', ''),
+# Only configured (and the provider only installed) when both the client ID and secret are set
+if GOOGLE_OAUTH_ENABLED:
+    SOCIALACCOUNT_PROVIDERS = {
+        'google': {
+            'SCOPE': [
+                'profile',
+                'email',
+            ],
+            'AUTH_PARAMS': {
+                'access_type': 'online',
+            },
+            'APP': {
+                'client_id': _GOOGLE_CLIENT_ID,
+                'secret': _GOOGLE_SECRET,
+            }
         }
     }
-}
 
-# Allow users to sign up via social accounts
-SOCIALACCOUNT_AUTO_SIGNUP = True
-SOCIALACCOUNT_EMAIL_VERIFICATION = 'none'
-SOCIALACCOUNT_QUERY_EMAIL = True
+    # Allow users to sign up via social accounts
+    SOCIALACCOUNT_AUTO_SIGNUP = True
+    SOCIALACCOUNT_EMAIL_VERIFICATION = 'none'
+    SOCIALACCOUNT_QUERY_EMAIL = True
 
-# Skip the intermediate page and redirect directly to provider
-SOCIALACCOUNT_STORE_TOKENS = True
+    # Skip the intermediate page and redirect directly to provider
+    SOCIALACCOUNT_STORE_TOKENS = True
 
 # Gemini API
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
+GEMINI_API_KEY = _E.get('GEMINI_API_KEY', '')
 
 # Debug: Uncomment to verify API key is loaded (remove after debugging)
 # if not GEMINI_API_KEY:
@@ -168,39 +209,80 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # Cursor (keyset) pagination avoids a COUNT(*) per page
+    'DEFAULT_PAGINATION_CLASS': 'apps.documents.pagination.CreatedAtCursorPagination',
     'PAGE_SIZE': 10
 }
 
 # Celery
-CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
-CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0'))
+CELERY_BROKER_URL = _E.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+# An empty CELERY_RESULT_BACKEND (e.g. left blank in .env) also falls back to the broker
+CELERY_RESULT_BACKEND = _E.get('CELERY_RESULT_BACKEND') or CELERY_BROKER_URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 
+# I/O bound stages (S3, Gemini, embeddings) and CPU bound OCR run on separate queues
+# so slow OCR jobs cannot starve uploads; see docker-compose.yml for the worker pools
+CELERY_TASK_ROUTES = {
+    'apps.documents.tasks.process_document': {'queue': 'io'},
+    'apps.documents.tasks.generate_document_embeddings': {'queue': 'io'},
+    'apps.documents.tasks.extract_text_pypdf': {'queue': 'cpu'},
+    'apps.documents.tasks.extract_text_ocr': {'queue': 'cpu'},
+    'apps.documents.tasks.poll_gemini_batches': {'queue': 'io'},
+    'apps.documents.tasks.cleanup_gemini_file': {'queue': 'low'},
+}
+
+# Finish documents extracted through the Gemini Batch API (needs `celery -A config beat`)
+CELERY_BEAT_SCHEDULE = {
+    'poll-gemini-batches': {
+        'task': 'apps.documents.tasks.poll_gemini_batches',
+        'schedule': 60.0,
+    },
+}
+
+# Cache (shared by web and workers): sessions, extracted text cache
+# Kept out of the broker's Redis DB so it can be evicted without touching queued tasks
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': _E.get('CACHE_URL', 'redis://localhost:6379/1'),
+    }
+}
+
+# Session reads come from the cache, writes still go to the database so a Redis
+# restart doesn't log everyone out
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 # AWS S3 Storage
-if os.getenv('AWS_ACCESS_KEY_ID'):
-    AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
-    AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
-    AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME')
-    AWS_S3_REGION_NAME = os.getenv('AWS_S3_REGION_NAME')
+# Everything S3 related (settings, the storages app and its boto3 import chain) stays
+# behind this one check
+AWS_ACCESS_KEY_ID = _E.get('AWS_ACCESS_KEY_ID')
+if AWS_ACCESS_KEY_ID:
+    AWS_SECRET_ACCESS_KEY = _E.get('AWS_SECRET_ACCESS_KEY')
+    AWS_STORAGE_BUCKET_NAME = _E.get('AWS_STORAGE_BUCKET_NAME')
+    AWS_S3_REGION_NAME = _E.get('AWS_S3_REGION_NAME')
     AWS_S3_SIGNATURE_VERSION = 's3v4'
-    
-    STORAGES = {
-        "default": {
-            "BACKEND": "storages.backends.s3.S3Storage",
-        },
-        "staticfiles": {
-            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
-        },
-    }
-else:
-    # Fallback for local dev without S3
-    STORAGES = {
+    INSTALLED_APPS.append('storages')
+
+
+def _build_storages(use_s3):
+    """
+    Return the STORAGES setting, S3 for uploads when configured.
+    """
+    # Local filesystem by default (local dev without S3)
+    storages = {
         "default": {
             "BACKEND": "django.core.files.storage.FileSystemStorage",
         },
+        # Content hashed file names (app.3f2a1c.css), safe to cache forever;
+        # needs `collectstatic` when DEBUG is off
         "staticfiles": {
-            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+            "BACKEND": "django.contrib.staticfiles.storage.ManifestStaticFilesStorage",
         },
     }
+    if use_s3:
+        storages["default"]["BACKEND"] = "storages.backends.s3.S3Storage"
+    return storages
+
+
+STORAGES = _build_storages(bool(AWS_ACCESS_KEY_ID))
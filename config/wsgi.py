@@ -8,9 +8,20 @@ https://docs.djangoproject.com/en/6.0/howto/deployment/wsgi/
 """
 
 import os
+from importlib import import_module
 
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# Import what the first request would otherwise load lazily, so it is paid at worker boot
+for _module in (
+    'django.db.models.sql.compiler',
+    'rest_framework.serializers',
+    'allauth.account.views',
+    'apps.documents.views',
+    'config.urls',
+):
+    import_module(_module)